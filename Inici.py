@@ -3,9 +3,13 @@ import os
 import base64
 import pathlib
 import requests
+from urllib.parse import urlencode
 from datetime import datetime, timezone
 from supabase import create_client, Client
 import uuid
+import orjson
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Try to import dotenv, but don't fail if it's not available
 try:
@@ -21,9 +25,15 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Load environment variables only in local development
-if DOTENV_AVAILABLE and os.path.exists('.env'):
-    load_dotenv()
+@st.cache_resource(show_spinner=False)
+def load_local_env():
+    """Load environment variables only in local development, once per process rather than on every rerun"""
+    if DOTENV_AVAILABLE and os.path.exists('.env'):
+        load_dotenv()
+
+load_local_env()
+
+logger = logging.getLogger(__name__)
 
 # Initialize Supabase client
 url: str = st.secrets.get("SUPABASE_URL")
@@ -35,7 +45,12 @@ if not url or not key:
     st.error("Missing Supabase credentials. Please check your environment variables or secrets.")
     st.stop()
 
-supabase: Client = create_client(url, key)
+@st.cache_resource
+def get_supabase_client(url, key) -> Client:
+    """Create the Supabase client once per process so its HTTP connection pool survives reruns"""
+    return create_client(url, key)
+
+supabase: Client = get_supabase_client(url, key)
 
 # Strava API credentials
 STRAVA_CLIENT_ID = st.secrets.get("STRAVA_CLIENT_ID", os.getenv("STRAVA_CLIENT_ID"))
@@ -51,7 +66,13 @@ if 'REDIRECT_URI' in st.secrets:
 else:
     REDIRECT_URI = os.getenv("REDIRECT_URI", "http://localhost:8501")  # Local development fallback
 
-AUTH_URL = f"http://www.strava.com/oauth/authorize?client_id={STRAVA_CLIENT_ID}&response_type=code&redirect_uri={REDIRECT_URI}&scope=activity:read_all"
+# https avoids a redirect hop, and urlencode keeps special characters in REDIRECT_URI intact
+AUTH_URL = "https://www.strava.com/oauth/authorize?" + urlencode({
+    'client_id': STRAVA_CLIENT_ID,
+    'response_type': 'code',
+    'redirect_uri': REDIRECT_URI,
+    'scope': 'activity:read_all'
+})
 
 def get_token(code):
     """Exchange authorization code for access token"""
@@ -62,37 +83,75 @@ def get_token(code):
         'code': code,
         'grant_type': 'authorization_code'
     }
-    response = requests.post(token_url, data=data)
-    return response.json()
+    # (connect, read) timeout so a stalled exchange can't hang the landing page
+    response = requests.post(token_url, data=data, timeout=(3, 10))
+    return orjson.loads(response.content)
 
 def save_token_to_supabase(token_data):
-    """Save or update token in Supabase"""
+    """Save or update token in Supabase, and keep the session copy the analysis page reuses"""
     token_record = {
         'athlete_id': token_data['athlete']['id'],
         'access_token': token_data['access_token'],
         'refresh_token': token_data['refresh_token'],
         'expires_at': datetime.fromtimestamp(token_data['expires_at'], tz=timezone.utc).isoformat(),
+        'expires_at_unix': int(token_data['expires_at']),
         'updated_at': datetime.now(timezone.utc).isoformat()
     }
     
-    supabase.table('strava_tokens').upsert(
-        token_record,
-        on_conflict='athlete_id'
-    ).execute()
+    try:
+        supabase.table('strava_tokens').upsert(
+            token_record,
+            on_conflict='athlete_id',
+            returning='minimal'
+        ).execute()
+    except Exception as e:
+        # Databases that haven't run the expires_at_unix migration in supabase_schema.sql reject
+        # the column: save the token without it instead of failing the connection
+        if 'expires_at_unix' not in str(e):
+            raise
+        supabase.table('strava_tokens').upsert(
+            {field: value for field, value in token_record.items() if field != 'expires_at_unix'},
+            on_conflict='athlete_id',
+            returning='minimal'
+        ).execute()
+
+    # The analysis page reuses this token without going back to Supabase until it is about to expire
+    st.session_state.access_token = token_record['access_token']
+    st.session_state.expires_epoch = token_record['expires_at_unix']
+
+@st.cache_resource
+def get_background_executor():
+    """Small thread pool, shared by all sessions, for Supabase writes the page doesn't need to wait on"""
+    return ThreadPoolExecutor(max_workers=2)
 
 def log_user_session(athlete_id, event_type, event_data=None):
-    """Log user session data to Supabase"""
+    """Log user session data to Supabase in the background"""
+    log_entry = {
+        'athlete_id': athlete_id if athlete_id is not None else 0,
+        'event_type': event_type,
+        'event_data': event_data,
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    }
+    
+    get_background_executor().submit(insert_log_entry, log_entry)
+
+def insert_log_entry(log_entry):
+    """Insert a log entry into Supabase. Runs on a worker thread, so errors go to the server log."""
     try:
-        log_entry = {
-            'athlete_id': athlete_id if athlete_id is not None else 0,
-            'event_type': event_type,
-            'event_data': event_data,
-            'timestamp': datetime.now(timezone.utc).isoformat()
-        }
-        
-        supabase.table('app_logs').insert(log_entry).execute()
+        supabase.table('app_logs').insert(log_entry, returning='minimal').execute()
     except Exception as e:
-        st.error(f"Error logging event: {str(e)}")
+        logger.error(f"Error logging event: {str(e)}")
+
+@st.cache_resource
+def load_asset_data_uri(filename, mime_type):
+    """
+    Read an asset and return it as a base64 data URI.
+
+    Cached as a resource so the file is read and encoded once per process instead of on every rerun.
+    """
+    with open(f"{current_dir}/assets/{filename}", "rb") as f:
+        b64_data = base64.b64encode(f.read()).decode("utf-8")
+    return f"data:{mime_type};base64,{b64_data}"
 
 def main():
     st.markdown("""
@@ -166,6 +225,62 @@ def main():
             font-weight: normal;
             margin-bottom: 50px;
         }
+        /* Video section */
+        .video-section {
+            width: 100%;
+            padding: 40px 20px;
+            background: linear-gradient(to bottom, rgba(255,255,255,0.9), rgba(255,255,255,0.9));
+            margin: 0px 0;
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+        }
+        .description-column {
+            flex: 1;
+            padding: 0 40px;
+        }
+        .video-column {
+            flex: 1;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+        }
+        .video-container {
+            width: 100%;
+            max-width: 800px;
+            position: relative;
+            border-radius: 10px;
+            overflow: hidden;
+            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
+            background: #000;
+        }
+        .video-title {
+            margin-bottom: 30px;
+        }
+        .video-title h2 {
+            font-family: 'Helvetica Neue', sans-serif;
+            font-size: 32px;
+            color: #222831;
+            margin-bottom: 15px;
+        }
+        .video-title p {
+            font-family: 'Helvetica Neue', sans-serif;
+            font-size: 18px;
+            color: #393E46;
+            line-height: 1.6;
+        }
+        .stVideo {
+            border-radius: 10px;
+            overflow: hidden;
+            width: 100% !important;
+        }
+        .stVideo > div {
+            width: 100% !important;
+        }
+        .stVideo > div > video {
+            width: 100% !important;
+            height: auto !important;
+        }
         </style>
     """, unsafe_allow_html=True)
     # Generate a unique session ID when the app starts
@@ -243,12 +358,7 @@ def main():
         </div>
     """, unsafe_allow_html=True)
 
-    # Path to your SVG file
-    svg_path = f"{current_dir}/assets/strava_button.svg"
-    with open(svg_path, "rb") as f:
-        svg_data = f.read()
-        b64_svg = base64.b64encode(svg_data).decode("utf-8")
-    svg_uri = f"data:image/svg+xml;base64,{b64_svg}"
+    svg_uri = load_asset_data_uri("strava_button.svg", "image/svg+xml")
 
     st.markdown(f"""
         <style>
@@ -284,12 +394,7 @@ def main():
         </div>
     """, unsafe_allow_html=True)
 
-    # Convert background image to base64
-    background_path = f"{current_dir}/assets/background.jpeg"
-    with open(background_path, "rb") as f:
-        background_data = f.read()
-        b64_background = base64.b64encode(background_data).decode("utf-8")
-    background_uri = f"data:image/jpeg;base64,{b64_background}"
+    background_uri = load_asset_data_uri("background.jpeg", "image/jpeg")
     
     # Create the entire section in a single markdown block
     st.markdown(f"""
@@ -377,66 +482,6 @@ def main():
         </div>
     """, unsafe_allow_html=True)
 
-    # Add video section
-    st.markdown("""
-        <style>
-        .video-section {
-            width: 100%;
-            padding: 40px 20px;
-            background: linear-gradient(to bottom, rgba(255,255,255,0.9), rgba(255,255,255,0.9));
-            margin: 0px 0;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        .description-column {
-            flex: 1;
-            padding: 0 40px;
-        }
-        .video-column {
-            flex: 1;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-        }
-        .video-container {
-            width: 100%;
-            max-width: 800px;
-            position: relative;
-            border-radius: 10px;
-            overflow: hidden;
-            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-            background: #000;
-        }
-        .video-title {
-            margin-bottom: 30px;
-        }
-        .video-title h2 {
-            font-family: 'Helvetica Neue', sans-serif;
-            font-size: 32px;
-            color: #222831;
-            margin-bottom: 15px;
-        }
-        .video-title p {
-            font-family: 'Helvetica Neue', sans-serif;
-            font-size: 18px;
-            color: #393E46;
-            line-height: 1.6;
-        }
-        .stVideo {
-            border-radius: 10px;
-            overflow: hidden;
-            width: 100% !important;
-        }
-        .stVideo > div {
-            width: 100% !important;
-        }
-        .stVideo > div > video {
-            width: 100% !important;
-            height: auto !important;
-        }
-        </style>
-    """, unsafe_allow_html=True)
 
     # Video path
     video_path = f"{current_dir}/assets/screen_recording.mp4"
@@ -463,15 +508,12 @@ def main():
     st.write("")
     col1, col2, col3 = st.columns(3)
     with col2:
-        st.markdown(
-        """<div style="display: flex; justify-content: center; align-items: center;">
-        <svg width='180' height='30' viewBox='0 0 365 37' fill='none' xmlns='http://www.w3.org/2000/svg'>
-            <path d='M0.905029 35.1577H3.31523V29.0503H7.34003C10.8266 29.0503 12.8858 27.1315 12.8858 23.9257C12.8858 20.7433 10.8266 18.7777 7.36343 18.7777H0.905029V35.1577ZM3.31523 26.8039V21.0241H7.26983C9.42263 21.0241 10.4756 21.9601 10.4756 23.9257C10.4756 25.8445 9.39923 26.8039 7.24643 26.8039H3.31523ZM23.6787 35.5087C27.8907 35.5087 30.6753 32.1157 30.6753 26.9677C30.6753 21.8197 27.8907 18.4267 23.6787 18.4267C19.4667 18.4267 16.7055 21.8197 16.7055 26.9677C16.7055 32.1157 19.4667 35.5087 23.6787 35.5087ZM23.6787 33.2623C20.8473 33.2623 19.1157 30.8755 19.1157 26.9677C19.1157 23.0599 20.8473 20.6731 23.6787 20.6731C26.5335 20.6731 28.2651 23.0599 28.2651 26.9677C28.2651 30.8755 26.5335 33.2623 23.6787 33.2623ZM37.4562 35.1577H40.2174L43.9848 22.5919H44.0316L47.7756 35.1577H50.5602L53.6958 18.7777H51.2388L48.8988 31.3201H48.852L45.1314 18.7777H42.8616L39.1644 31.3201H39.1176L36.7776 18.7777H34.2972L37.4562 35.1577ZM58.3356 35.1577H68.3742V32.9113H60.7458V27.8101H67.719V25.6573H60.7458V21.0241H68.3742V18.7777H58.3356V35.1577ZM81.6314 28.5823C84.0416 28.0441 85.469 26.2891 85.469 23.7619C85.469 20.6497 83.3864 18.7777 79.97 18.7777H73.7924V35.1577H76.2026V28.7695H79.0808L82.4504 35.1577H85.1648L81.6314 28.6057V28.5823ZM76.2026 26.5465V21.0241H79.736C81.9356 21.0241 83.0588 21.9367 83.0588 23.7619C83.0588 25.5871 81.9122 26.5465 79.736 26.5465H76.2026ZM90.4832 35.1577H100.522V32.9113H92.8934V27.8101H99.8666V25.6573H92.8934V21.0241H100.522V18.7777H90.4832V35.1577ZM105.94 35.1577H111.111C115.417 35.1577 118.295 32.5369 118.295 26.9443C118.295 21.7963 115.417 18.7777 111.205 18.7777H105.94V35.1577ZM108.35 32.9113V21.0241H111.135C114.036 21.0241 115.885 23.0131 115.885 26.9443C115.885 31.2031 114.036 32.9113 111.018 32.9113H108.35ZM132.055 35.1577H138.115C142 35.1577 144.012 33.4729 144.012 30.2437C144.012 28.3951 143.053 26.9677 141.579 26.3827V26.3359C142.702 25.7743 143.404 24.5809 143.404 23.0599C143.404 20.5093 141.462 18.7777 138.607 18.7777H132.055V35.1577ZM134.465 25.5871V21.0007H138.209C140.034 21.0007 140.994 21.7729 140.994 23.2705C140.994 24.8149 140.081 25.5871 138.209 25.5871H134.465ZM134.465 32.9347V27.6229H138.162C140.572 27.6229 141.602 28.4185 141.602 30.2203C141.602 32.1157 140.549 32.9347 138.115 32.9347H134.465ZM151.963 35.1577H154.373V28.3717L160.012 18.7777H157.321L153.18 26.1253H153.133L148.991 18.7777H146.3L151.963 28.3717V35.1577Z' fill='black'/>
-            <path fill-rule='evenodd' clip-rule='evenodd' d='M275.925 35.6008L275.923 35.5993H286.002L292.193 23.1514L298.383 35.5993H310.63L292.191 0L274.689 33.7968L267.969 23.9845C272.118 21.9836 274.704 18.5181 274.704 13.54V13.442C274.704 9.92849 273.631 7.39027 271.581 5.34009C269.189 2.94868 265.334 1.43574 259.282 1.43574H242.59V35.6008H254.011V25.8391H256.451L262.893 35.6008H275.925ZM346.353 0L327.917 35.5993H340.164L346.354 23.1514L352.545 35.5993H364.791L346.353 0ZM319.283 37L337.719 1.40071H325.473L319.282 13.8486L313.091 1.40071H300.845L319.283 37ZM258.94 17.6885C261.673 17.6885 263.333 16.4684 263.333 14.3698V14.2718C263.333 12.0756 261.624 11.0019 258.989 11.0019H254.01V17.6885H258.94ZM218.165 11.0994H208.112V1.43574H239.64V11.0994H229.587V35.6008H218.165V11.0994ZM180.282 23.2037L174.181 30.476C178.525 34.2835 184.772 36.2353 191.703 36.2353C200.879 36.2353 206.784 31.8425 206.784 24.6675V24.5703C206.784 17.6885 200.928 15.1502 192.191 13.5401C188.579 12.856 187.652 12.2712 187.652 11.3435V11.2459C187.652 10.4162 188.433 9.83056 190.141 9.83056C193.313 9.83056 197.17 10.8554 200.39 13.1981L205.955 5.48697C202.001 2.36309 197.121 0.800959 190.532 0.800959C181.111 0.800959 176.036 5.8286 176.036 12.3196V12.4176C176.036 19.6406 182.772 21.8376 190.434 23.3986C194.095 24.131 195.168 24.6675 195.168 25.644V25.742C195.168 26.6689 194.29 27.2053 192.24 27.2053C188.238 27.2053 183.992 26.0348 180.282 23.2037Z' fill='#FC5200'/>
-        </svg>
-        </div>""", 
-        unsafe_allow_html=True
-    )
+        powered_by_uri = load_asset_data_uri("powered_by_strava.svg", "image/svg+xml")
+        st.markdown(f"""
+            <div style="display: flex; justify-content: center; align-items: center;">
+                <img src="{powered_by_uri}" width="180" height="30" alt="Powered by Strava"/>
+            </div>
+        """, unsafe_allow_html=True)
     st.write("")
     st.write("")
 if __name__ == "__main__":
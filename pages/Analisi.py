@@ -1,17 +1,25 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
-from datetime import datetime, timezone
+import numpy as np
+from datetime import datetime, timedelta, timezone
 import os
 from supabase import create_client, Client
 import plotly.graph_objects as go
+import plotly.io as pio
 import time
-from plotly.subplots import make_subplots
+import hashlib
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 import pathlib
 import uuid
 from typing import Optional
 import base64
 import openai
+import orjson
+import logging
 
 st.set_page_config(
     page_title="Analitza el teu entrenament",
@@ -86,6 +94,12 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+logger = logging.getLogger(__name__)
+
+# st.plotly_chart serializes figures with plotly.io.to_json: use orjson (already a dependency)
+# instead of the standard json encoder for the trace arrays
+pio.json.config.default_engine = 'orjson'
+
 # Initialize Supabase client
 url: str = st.secrets.get("SUPABASE_URL")
 key: str = st.secrets.get("SUPABASE_KEY")
@@ -96,7 +110,12 @@ if not url or not key:
     st.error("Missing Supabase credentials. Please check your environment variables or secrets.")
     st.stop()
 
-supabase: Client = create_client(url, key)
+@st.cache_resource
+def get_supabase_client(url, key) -> Client:
+    """Create the Supabase client once per process so its HTTP connection pool survives reruns"""
+    return create_client(url, key)
+
+supabase: Client = get_supabase_client(url, key)
 
 # Strava API credentials
 STRAVA_CLIENT_ID = st.secrets.get("STRAVA_CLIENT_ID", os.getenv("STRAVA_CLIENT_ID"))
@@ -120,13 +139,55 @@ if 'REDIRECT_URI' in st.secrets:
 else:
     REDIRECT_URI = os.getenv("REDIRECT_URI", "http://localhost:8501")  # Local development fallback
 
-def highlight_high_percentage(val):
-    try:
-        # Extract numeric value from percentage string (e.g., "35.5%" -> 35.5)
-        numeric_val = float(val.replace('%', ''))
-        return 'background-color: #ffcdd2' if numeric_val > 40 else ''
-    except:
-        return ''
+# Catalan month abbreviations for the chart date labels
+CATALAN_MONTHS = {
+    'Jan': 'Gen',
+    'Feb': 'Feb',
+    'Mar': 'Mar',
+    'Apr': 'Abr',
+    'May': 'Mai',
+    'Jun': 'Jun',
+    'Jul': 'Jul',
+    'Aug': 'Ago',
+    'Sep': 'Set',
+    'Oct': 'Oct',
+    'Nov': 'Nov',
+    'Dec': 'Des'
+}
+
+# Colors for each intensity zone, in stacking order
+INTENSITY_COLORS = {
+    'Baixa': '#2ecc71',    # Green
+    'Moderada': '#f1c40f', # Yellow
+    'Alta': '#e74c3c'      # Red
+}
+
+# Known race distances (km) and the factors that adjust their pace to a one-hour effort
+RACE_DISTANCES = np.array([5.0, 10.0, 15.0, 21.1, 42.2])
+RACE_PACE_FACTORS = np.array([1.05, 1.03, 1.00, 0.98, 0.95])
+
+# (connect, read) timeout in seconds for every Strava request, so a stalled call can't hang the page
+STRAVA_TIMEOUT = (3, 10)
+
+@st.cache_resource
+def get_http_session():
+    """
+    Shared requests session for the Strava API.
+
+    Cached as a resource so the pooled keep-alive connections survive reruns. Rate-limit
+    (429) and transient server errors are retried by the adapter, honouring Retry-After.
+    """
+    session = requests.Session()
+    # Negotiate JSON once for every request; gzip is already in requests' default Accept-Encoding
+    session.headers['Accept'] = 'application/json'
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+    return session
 
 def get_token(code):
     """Exchange authorization code for access token"""
@@ -137,8 +198,8 @@ def get_token(code):
         'code': code,
         'grant_type': 'authorization_code'
     }
-    response = requests.post(token_url, data=data)
-    return response.json()
+    response = get_http_session().post(token_url, data=data, timeout=STRAVA_TIMEOUT)
+    return orjson.loads(response.content)
 
 def refresh_token(refresh_token):
     """Refresh the access token using the refresh token"""
@@ -149,27 +210,42 @@ def refresh_token(refresh_token):
         'refresh_token': refresh_token,
         'grant_type': 'refresh_token'
     }
-    response = requests.post(token_url, data=data)
-    return response.json()
+    response = get_http_session().post(token_url, data=data, timeout=STRAVA_TIMEOUT)
+    return orjson.loads(response.content)
 
 def save_token_to_supabase(token_data):
-    """Save or update token in Supabase"""
+    """Save or update token in Supabase, and keep the session copy used by ensure_fresh_token in sync"""
     try:
+        expires_at = datetime.fromtimestamp(token_data['expires_at'], tz=timezone.utc)
         token_record = {
-            'athlete_id': token_data['athlete']['id'],
+            # Refresh responses don't include the athlete, so fall back to the id we attached
+            'athlete_id': token_data['athlete']['id'] if 'athlete' in token_data else token_data['athlete_id'],
             'access_token': token_data['access_token'],
             'refresh_token': token_data['refresh_token'],
-            'expires_at': datetime.fromtimestamp(token_data['expires_at'], tz=timezone.utc).isoformat(),
+            'expires_at': expires_at.isoformat(),
+            'expires_at_unix': int(token_data['expires_at']),
             'updated_at': datetime.now(timezone.utc).isoformat()
         }
         
-        supabase.table('strava_tokens').upsert(
-            token_record,
-            on_conflict='athlete_id'
-        ).execute()
-        
-        # Verify the token was saved
-        stored_token = get_stored_token(token_record['athlete_id'])
+        try:
+            supabase.table('strava_tokens').upsert(
+                token_record,
+                on_conflict='athlete_id',
+                returning='minimal'
+            ).execute()
+        except Exception as e:
+            # Databases that haven't run the expires_at_unix migration in supabase_schema.sql reject
+            # the column: save the token without it instead of failing the refresh
+            if 'expires_at_unix' not in str(e):
+                raise
+            supabase.table('strava_tokens').upsert(
+                {field: value for field, value in token_record.items() if field != 'expires_at_unix'},
+                on_conflict='athlete_id',
+                returning='minimal'
+            ).execute()
+
+        st.session_state.access_token = token_record['access_token']
+        st.session_state.expires_epoch = token_record['expires_at_unix']
 
     except Exception as e:
         st.error(f"Error saving token to Supabase: {str(e)}")
@@ -193,14 +269,23 @@ def ensure_fresh_token():
     """Ensure we have a valid token"""
     if 'athlete_id' not in st.session_state or st.session_state.athlete_id is None:
         return None
-        
+
+    # Reuse the token already in session while it is not about to expire (within 5 minutes),
+    # comparing Strava's Unix expiry directly with the clock
+    expires_epoch = st.session_state.get('expires_epoch')
+    if st.session_state.get('access_token') and expires_epoch and expires_epoch - time.time() > 300:
+        return st.session_state.access_token
+
     stored_token = get_stored_token(st.session_state.athlete_id)
     if not stored_token:
         return None
         
-    # Check if token is expired or about to expire (within 5 minutes)
-    expires_at = datetime.fromisoformat(stored_token['expires_at'].replace('Z', '+00:00'))
-    if expires_at <= datetime.now(timezone.utc):
+    # Check if token is expired or about to expire (within 5 minutes). Rows saved before
+    # expires_at_unix existed, or databases without the column, fall back to the ISO expiry.
+    expires_at_unix = stored_token.get('expires_at_unix')
+    if expires_at_unix is None:
+        expires_at_unix = int(datetime.fromisoformat(stored_token['expires_at'].replace('Z', '+00:00')).timestamp())
+    if expires_at_unix <= int(time.time()) + 300:
         # Token is expired, refresh it
         try:
             new_token = refresh_token(stored_token['refresh_token'])
@@ -213,111 +298,238 @@ def ensure_fresh_token():
         except Exception as e:
             st.error(f"Error refreshing token: {str(e)}")
             return None
-        
+
+    st.session_state.expires_epoch = expires_at_unix
     return stored_token['access_token']
 
-@st.cache_data(show_spinner="S'estan carregant les teves activitats...")
-def get_activities(access_token):
-    """Fetch athlete's activities from Strava"""
+@st.cache_data(ttl=900, show_spinner="S'estan carregant les teves activitats...")
+def get_activities(athlete_id, _access_token, after=None):
+    """
+    Fetch athlete's activities from Strava as a DataFrame (empty if none were found).
+
+    The cache is keyed on athlete_id and after only: the leading underscore keeps the
+    token out of Streamlit's hash, so refreshed tokens still hit the cache.
+    Entries expire after 15 minutes so new activities show up without a restart.
+
+    Parameters:
+    - after: optional Unix timestamp; only activities started after it are fetched
+
+    Returns:
+    - activity_data: the fetched activities
+    - complete: False if the pagination stopped early (an error or the rate limit), in
+      which case activity_data only holds the pages fetched before it
+    """
     activities_url = "https://www.strava.com/api/v3/athlete/activities"
-    headers = {'Authorization': f'Bearer {access_token}'}
-    activities = []
+    headers = {'Authorization': f'Bearer {_access_token}'}
+    session = get_http_session()
+    per_page = 200
+    wave_size = 5
     page = 1
+
+    def fetch_page(page_number):
+        # 429 responses are retried by the session adapter after Retry-After
+        params = {'page': page_number, 'per_page': per_page}
+        if after is not None:
+            params['after'] = after
+        return session.get(activities_url, headers=headers, params=params, timeout=STRAVA_TIMEOUT)
     
-    # Initialize rate limiting parameters
-    requests_in_window = 0
-    window_start = datetime.now(timezone.utc)
-    daily_requests = 0
-    daily_start = window_start.replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    while True:
-        # Check rate limits
-        current_time = datetime.now(timezone.utc)
-        
-        # Reset 15-minute window counter if needed
-        if (current_time - window_start).total_seconds() > 900:  # 15 minutes
-            requests_in_window = 0
-            window_start = current_time
-            
-        # Reset daily counter if needed
-        if current_time.date() > daily_start.date():
-            daily_requests = 0
-            daily_start = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
-            
-        # Check if we're within limits
-        if requests_in_window >= 100:
-            wait_time = 900 - (current_time - window_start).total_seconds()
-            st.warning(f"S'ha arribat al límit de peticions. Esperant {int(wait_time)} segons...")
-            time.sleep(wait_time)
-            requests_in_window = 0
-            window_start = datetime.now(timezone.utc)
-            
-        if daily_requests >= 1000:
-            st.error("S'ha arribat al límit diari de peticions. Torna-ho a provar demà.")
-            break
-            
-        params = {'page': page, 'per_page': 200}
+    def rate_limit_usage(response):
+        # Strava reports "15-minute,daily" pairs for the requests used and allowed
         try:
-            response = requests.get(activities_url, headers=headers, params=params)
-            requests_in_window += 1
-            daily_requests += 1
-            
-            if response.status_code == 429:  # Rate limit exceeded
-                retry_after = int(response.headers.get('Retry-After', 60))
-                st.warning(f"S'ha arribat al límit de peticions. Esperant {retry_after} segons...")
-                time.sleep(retry_after)
-                continue
+            used_15, used_day = map(int, response.headers['X-RateLimit-Usage'].split(','))
+            limit_15, limit_day = map(int, response.headers['X-RateLimit-Limit'].split(','))
+        except (KeyError, ValueError):
+            return None
+        return used_15, used_day, limit_15, limit_day
+
+    # Only the fields used here are kept, one list per column, as each page arrives
+    # (json_normalize would flatten every nested field, maps and polylines included);
+    # optional fields missing from an activity are None, which becomes NaN with the
+    # float32 cast below
+    required_fields = [
+        'id', 'name', 'type', 'sport_type', 'start_date_local', 'distance', 'moving_time',
+        'elapsed_time', 'total_elevation_gain', 'average_speed', 'max_speed'
+    ]
+    optional_fields = [
+        'average_heartrate', 'max_heartrate', 'elev_high', 'elev_low', 'average_temp', 'workout_type'
+    ]
+    columns = {field: [] for field in ['athlete_id', *required_fields, *optional_fields]}
+    pick_required = itemgetter(*required_fields)
+
+    def collect_fields(page_activities):
+        # The page's parsed JSON can be freed once its fields are copied out
+        columns['athlete_id'].extend(activity['athlete']['id'] for activity in page_activities)
+        # One itemgetter call per activity picks all required fields; zip turns the rows into columns
+        for field, values in zip(required_fields, zip(*map(pick_required, page_activities))):
+            columns[field].extend(values)
+        for field in optional_fields:
+            columns[field].extend(activity.get(field) for activity in page_activities)
+
+    usage = None
+    # Only set once the last (short) page has been read
+    complete = False
+    
+    # Page 1 is fetched alone; if it is full, the following pages are fetched in parallel
+    # waves until a wave returns a short page. The workers only do the HTTP calls: the
+    # rate-limit checks and the Streamlit messages stay on this thread.
+    with ThreadPoolExecutor(max_workers=wave_size) as executor:
+        while True:
+            wave = [page] if page == 1 else list(range(page, page + wave_size))
+
+            # Check the usage Strava reported for the previous wave leaves room for this one
+            if usage:
+                used_15, used_day, limit_15, limit_day = usage
+                if used_day + len(wave) > limit_day:
+                    st.error("S'ha arribat al límit diari de peticions. Torna-ho a provar demà.")
+                    break
+                if used_15 + len(wave) > limit_15:
+                    # Strava's 15-minute windows reset on the quarter hour
+                    wait_time = 900 - time.time() % 900
+                    st.warning(f"S'ha arribat al límit de peticions. Esperant {int(wait_time)} segons...")
+                    time.sleep(wait_time)
                 
-            if response.status_code != 200:
-                st.error(f"Error en obtenir les activitats: {response.status_code}")
+            try:
+                responses = list(executor.map(fetch_page, wave))
+            except Exception as e:
+                st.error(f"Error en connectar amb Strava: {str(e)}")
                 break
-                
-            response_data = response.json()
-            if not response_data:
+
+            page += len(wave)
+            usages = [u for u in map(rate_limit_usage, responses) if u]
+            usage = tuple(map(max, zip(*usages))) if usages else None
+
+            # Keep the pages in order and stop at the first error or short page
+            finished = False
+            for response in responses:
+                if response.status_code != 200:
+                    st.error(f"Error en obtenir les activitats: {response.status_code}")
+                    finished = True
+                    break
+                    
+                response_data = orjson.loads(response.content)
+                collect_fields(response_data)
+                if len(response_data) < per_page:
+                    finished = complete = True
+                    break
+
+            if finished:
                 break
-                
-            activities.extend(response_data)
-            page += 1
-            
-        except Exception as e:
-            st.error(f"Error en connectar amb Strava: {str(e)}")
-            break
 
-    activity_data = []
-    for activity in activities:
-        activity_data.append({
-            "athlete_id": activity["athlete"]["id"],
-            "activity_id": activity["id"],
-            "name": activity["name"],
-            "sport": activity["type"],
-            "type": activity["sport_type"],
-            "datetime_local": activity["start_date_local"],
-            "distance": activity["distance"]/1000,
-            "moving_time": activity["moving_time"]/60,
-            "elapsed_time": activity["elapsed_time"]/60,
-            "elevation_gain": activity["total_elevation_gain"],
-            "average_speed": activity["average_speed"] * 3.6,
-            "max_speed": activity["max_speed"] * 3.6,
-            "average_heartrate": activity.get("average_heartrate", None),
-            "max_heartrate": activity.get("max_heartrate", None),
-            "elev_high": activity.get("elev_high", None),
-            "elev_low": activity.get("elev_low", None),
-            "average_temp": activity.get("average_temp", None),
-            "workout_type": activity.get("workout_type", None)
-        })
+    if not columns['id']:
+        return pd.DataFrame(), complete
+
+    raw = pd.DataFrame(columns)
+    activity_data = pd.DataFrame({
+        "athlete_id": raw["athlete_id"],
+        "activity_id": raw["id"],
+        "name": raw["name"],
+        "sport": raw["type"],
+        "type": raw["sport_type"],
+        # start_date_local is local time with a misleading 'Z': parse it once, as naive local time
+        "datetime_local": pd.to_datetime(raw["start_date_local"].str.rstrip('Z')),
+        "distance": raw["distance"] / 1000,
+        "moving_time": raw["moving_time"] / 60,
+        "elapsed_time": raw["elapsed_time"] / 60,
+        "elevation_gain": raw["total_elevation_gain"],
+        "average_speed": raw["average_speed"] * 3.6,
+        "max_speed": raw["max_speed"] * 3.6,
+        "average_heartrate": raw["average_heartrate"],
+        "max_heartrate": raw["max_heartrate"],
+        "elev_high": raw["elev_high"],
+        "elev_low": raw["elev_low"],
+        "average_temp": raw["average_temp"],
+        "workout_type": raw["workout_type"]
+    })
+
+    # Measurements fit in float32, halving the memory of the cached frame and of every scan over it.
+    # moving_time stays float64: its weekly sums are truncated to whole minutes for the time labels,
+    # and float32 rounding would shift some of them down by a minute
+    activity_data = activity_data.astype({
+        column: 'float32' for column in [
+            'distance', 'elapsed_time', 'elevation_gain', 'average_speed', 'max_speed',
+            'average_heartrate', 'max_heartrate', 'elev_high', 'elev_low', 'average_temp', 'workout_type'
+        ]
+    })
     
-    return activity_data
+    return activity_data, complete
 
-@st.cache_data(show_spinner="Guardant les activitats...")
-def save_activities_to_supabase(activities, athlete_id):
-    """Save activities to Supabase"""
-    for activity in activities:
-        activity['athlete_id'] = athlete_id
-        activity['datetime_local'] = activity['datetime_local'].replace('Z', '')
-        supabase.table('activities').upsert(
-            activity,
-            on_conflict='activity_id'
-        ).execute()
+def sync_activities(athlete_id, access_token):
+    """
+    Get the athlete's activities, downloading from Strava only what is new in this session.
+
+    The first sync of a session loads the whole history. Once the session copy is older
+    than 15 minutes, only activities started after the latest known one are requested
+    (Strava's after= parameter) and merged in, so a refresh costs one page instead of
+    the full pagination. This needs the session copy to hold the whole history: if the
+    last fetch stopped early (an error or the rate limit), the whole history is fetched
+    again instead.
+
+    A refresh only sees new activities and edits to those of the last day. Deleted
+    activities and edits to older ones need a full fetch, so the whole history is
+    fetched again once the last full fetch is an hour old.
+
+    The session copy is stored with the dtypes the analysis uses, so reruns within the
+    15 minutes return it as is, without copying or converting columns again.
+
+    Returns:
+    - activities: the athlete's activities, newest first
+    - data_version: hash of the activities' contents (the cached analysis is keyed on it).
+      It changes as soon as a refresh brings in new activities or edits to the last day's
+      ones, and at the next hourly full fetch for deletions and edits to older activities
+    """
+    snapshot = st.session_state.get('activities_snapshot')
+    # Only the snapshot's age matters, so a monotonic clock is enough (and immune to clock changes)
+    now = time.monotonic()
+
+    has_snapshot = snapshot and snapshot['athlete_id'] == athlete_id and not snapshot['activities'].empty
+    if has_snapshot and now - snapshot['synced_at'] < 900:
+        return snapshot['activities'], snapshot['data_version']
+
+    if has_snapshot and snapshot['complete'] and now - snapshot['full_synced_at'] < 3600:
+        full_synced_at = snapshot['full_synced_at']
+        known = snapshot['activities']
+        # datetime_local is local time, so step back a day to not miss activities around
+        # the timezone offset; the overlap is dropped by activity_id
+        after = int(known['datetime_local'].max().timestamp()) - 86400
+        # An incomplete refresh leaves the merged copy incomplete too, so the next sync is a full one
+        new, complete = get_activities(athlete_id, access_token, after=after)
+        if new.empty:
+            activities = known
+        else:
+            # after= pages come oldest first: reverse them to keep the newest-first order
+            activities = pd.concat([new.iloc[::-1], known], ignore_index=True)
+            activities = activities.drop_duplicates('activity_id', keep='first', ignore_index=True)
+    else:
+        # First sync of the session, an incomplete copy or the hourly full fetch: the fetched
+        # history replaces the session copy, so deleted activities are dropped
+        full_synced_at = now
+        activities, complete = get_activities(athlete_id, access_token)
+
+    if not activities.empty:
+        # Strava orders by UTC start time; keep the rows strictly newest first by local time so
+        # a date range is always one contiguous block of rows
+        activities = activities.sort_values('datetime_local', ascending=False, kind='stable', ignore_index=True)
+        # Low-cardinality labels as categories so equality/isin filters compare integer codes
+        activities['sport'] = activities['sport'].astype('category')
+        activities['type'] = activities['type'].astype('category')
+        # Free-text names as Arrow strings: packed buffer instead of one Python object per row
+        activities['name'] = activities['name'].astype('string[pyarrow]')
+
+    # Hashing the whole frame catches changes that keep the activity count (a renamed run or a
+    # corrected distance, or a deleted activity replaced by another at the next full fetch)
+    data_version = hashlib.sha1(
+        pd.util.hash_pandas_object(activities, index=False).to_numpy().tobytes()
+    ).hexdigest()
+
+    st.session_state.activities_snapshot = {
+        'athlete_id': athlete_id,
+        'activities': activities,
+        'data_version': data_version,
+        'complete': complete,
+        'synced_at': now,
+        'full_synced_at': full_synced_at
+    }
+    return activities, data_version
 
 def pace_to_speed(minutes, seconds=0):
     # Convert pace (min/km) to speed (km/h)
@@ -337,14 +549,112 @@ def decimal_pace_to_str(decimal_pace: float) -> str:
     seconds = round((decimal_pace - minutes) * 60)
     return f"{minutes}:{seconds:02d} min/km"
 
-# Label intensity
-def label_intensity(index):
-    if index <= 0.95:
-        return "Alta"
-    elif index <= 1.15:
-        return "Moderada"
+def format_activity_columns(distance, moving_time, average_speed, clock_time=False):
+    """
+    Format distance (km), moving time (min) and average speed (km/h) columns for display.
+
+    All the numeric decomposition happens in one pass over NumPy arrays and the strings
+    are built with np.char, so the activity tables need no per-row Python formatting.
+
+    Parameters:
+    - clock_time: show the time as "1:05" instead of "1h5min"
+
+    Returns:
+    - Tuple of string arrays (distance, moving_time, pace); activities without a positive
+      average speed get "-" as pace
+    """
+    distance = np.asarray(distance, dtype=float)
+    moving_time = np.asarray(moving_time, dtype=float)
+    average_speed = np.asarray(average_speed, dtype=float)
+    # Zero or missing speeds have no pace: divide only where the speed is positive
+    has_pace = average_speed > 0
+    pace = np.divide(60, average_speed, out=np.zeros_like(average_speed), where=has_pace)
+
+    # Numeric decomposition, one divmod per quantity
+    total_minutes = moving_time.astype(np.int64)
+    hours, minutes = np.divmod(total_minutes, 60)
+    pace_minutes, pace_fraction = np.divmod(pace, 1)
+    pace_minutes = pace_minutes.astype(np.int64)
+    pace_seconds = (pace_fraction * 60).astype(np.int64)
+
+    # String building
+    distance_str = np.char.add(np.round(distance, 1).astype(str), ' km')
+
+    if clock_time:
+        time_str = np.char.add(np.char.add(hours.astype(str), ':'), np.char.zfill(minutes.astype(str), 2))
     else:
-        return "Baixa"
+        # The branch is resolved as a mask, not a per-row if
+        time_str = np.where(
+            total_minutes >= 60,
+            np.char.add(np.char.add(hours.astype(str), 'h'), np.char.add(minutes.astype(str), 'min')),
+            np.char.add(total_minutes.astype(str), 'min')
+        )
+
+    pace_str = np.where(
+        has_pace,
+        np.char.add(
+            np.char.add(pace_minutes.astype(str), ':'),
+            np.char.add(np.char.zfill(pace_seconds.astype(str), 2), ' min/km')
+        ),
+        '-'
+    )
+    return distance_str, time_str, pace_str
+
+def format_pct_changes(pct):
+    """
+    Format week-over-week percentage changes as chart labels ("+5%", "-12%") and pick their colors.
+
+    Changes beyond ±10% are highlighted in gold, the rest (and missing values) are green.
+
+    Returns:
+    - Tuple of string arrays (labels, colors); missing changes get an empty label
+    """
+    pct = np.asarray(pct, dtype=float)
+    rounded = np.round(np.where(np.isfinite(pct), pct, 0))
+    labels = np.char.add(
+        np.char.add(np.where(np.signbit(rounded), '-', '+'), np.abs(rounded).astype(np.int64).astype(str)),
+        '%'
+    )
+    # Changes from a week with no distance are infinite
+    labels = np.where(np.isinf(pct), np.where(pct > 0, '+inf%', '-inf%'), labels)
+    labels = np.where(np.isnan(pct), '', labels)
+    colors = np.where((pct > 10) | (pct < -10), '#DAA520', 'green')
+    return labels, colors
+
+def week_start_dates(year, week):
+    """
+    Get the Monday that starts each week, as parsed by pd.to_datetime with format '%Y-%W-%w'.
+
+    Computed with datetime64 arithmetic on the integer year and week columns, so the weekly
+    tables don't build and parse a "2024-05-1" string per row.
+
+    Returns:
+    - datetime64 array of Mondays
+    """
+    year = np.asarray(year, dtype=np.int64)
+    week = np.asarray(week, dtype=np.int64)
+    jan_first = (year - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+    # 1970-01-01 was a Thursday (weekday 3, Monday being 0)
+    jan_first_weekday = (jan_first.astype(np.int64) + 3) % 7
+    # Week 1 starts on the first Monday of the year
+    first_monday = jan_first + (7 - jan_first_weekday) % 7
+    return (first_monday + (week - 1) * 7).astype('datetime64[ns]')
+
+def format_catalan_dates(dates, full_year=False):
+    """
+    Format dates as chart labels with Catalan month names ("04-Des-23", or "04-Des-2023").
+
+    Built from the day, month and year numbers with np.char, so no label is formatted
+    and patched one by one.
+
+    Returns:
+    - String array of labels
+    """
+    day = np.char.zfill(dates.dt.day.to_numpy().astype(str), 2)
+    month = np.array(list(CATALAN_MONTHS.values()))[dates.dt.month.to_numpy() - 1]
+    year = dates.dt.year.to_numpy()
+    year = year.astype(str) if full_year else np.char.zfill((year % 100).astype(str), 2)
+    return np.char.add(np.char.add(np.char.add(day, '-'), np.char.add(month, '-')), year)
 
 def add_hr_intensity_index(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -385,18 +695,8 @@ def add_intensity_index(df: pd.DataFrame, reference_pace: float, race_distance:
     if "average_pace" not in df.columns:
         raise ValueError("DataFrame must contain a 'average_pace' column in min/km")
 
-    # Known race distances and their corresponding adjustment factors
-    distance_factors = {
-        5.0: 1.05,
-        10.0: 1.03,
-        15.0: 1.00,
-        21.1: 0.98,
-        42.2: 0.95
-    }
-
-    # Find the closest race distance
-    closest_dist = min(distance_factors.keys(), key=lambda d: abs(d - race_distance))
-    factor = distance_factors[closest_dist]
+    # Use the adjustment factor of the closest known race distance
+    factor = RACE_PACE_FACTORS[np.argmin(np.abs(RACE_DISTANCES - race_distance))]
 
     # Adjust race pace
     adjusted_reference_pace = reference_pace * factor
@@ -406,7 +706,12 @@ def add_intensity_index(df: pd.DataFrame, reference_pace: float, race_distance:
     # Calculate intensity index
     df["intensity_index"] = df["average_pace"] / adjusted_reference_pace
 
-    df["intensity_zone_pace"] = df["intensity_index"].apply(label_intensity)
+    # Label intensity: the first matching bound wins, anything slower (or missing) is easy
+    df["intensity_zone_pace"] = np.select(
+        [df["intensity_index"] <= 0.95, df["intensity_index"] <= 1.15],
+        ["Alta", "Moderada"],
+        default="Baixa"
+    )
 
     return df, adjusted_reference_pace_str
 
@@ -422,17 +727,17 @@ def get_activity_details(activity_id, access_token):
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    response = requests.get(url, headers=headers)
-    return response.json()
+    response = get_http_session().get(url, headers=headers, timeout=STRAVA_TIMEOUT)
+    return orjson.loads(response.content)
 
 def get_segment_details(segment_id, access_token):
     url = f"https://www.strava.com/api/v3/segments/{segment_id}"
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    response = requests.get(url, headers=headers)
+    response = get_http_session().get(url, headers=headers, timeout=STRAVA_TIMEOUT)
     response.raise_for_status()  # Raise an error for bad responses
-    return response.json()
+    return orjson.loads(response.content)
 
 def get_starred_segments(access_token):
     """
@@ -454,13 +759,13 @@ def get_starred_segments(access_token):
     
     while True:
         params = {'page': page, 'per_page': 200}
-        response = requests.get(url, headers=headers, params=params)
+        response = get_http_session().get(url, headers=headers, params=params, timeout=STRAVA_TIMEOUT)
         
         if response.status_code != 200:
             st.error(f"Error getting starred segments: {response.status_code}")
             break
             
-        data = response.json()
+        data = orjson.loads(response.content)
         if not data:
             break
             
@@ -469,6 +774,468 @@ def get_starred_segments(access_token):
     
     return starred_segments
 
+@st.cache_data(ttl=3600, max_entries=100, show_spinner=False)
+def build_longest_runs(filter_key, _df_filtered):
+    """
+    Build the longest run of each week and the formatted table for the long runs section.
+
+    Cached on the filter key (athlete, data version of the loaded activities, dates and types)
+    instead of hashing the filtered frame, so reruns with the same filters reuse the grouped and
+    formatted frames. Entries expire after an hour and at most 100 are kept.
+
+    Returns:
+    - longest_runs: longest run per week with its percentage of the weekly running distance
+    - weekly_totals: weekly running distance
+    - longest_runs_display: formatted table ready to display
+    """
+    # One groupby gives each week's running distance and, via idxmax, the row label of its longest run
+    df_runs = _df_filtered[_df_filtered['is_run'].to_numpy()]
+    weekly = df_runs.groupby(['iso_year', 'iso_week'])['distance'].agg(['sum', 'idxmax']).reset_index()
+    weekly_totals = weekly[['iso_year', 'iso_week', 'sum']]
+    weekly_totals.columns = ['year', 'week', 'weekly_total']
+
+    # The longest runs come out in the same week order as the totals, so no merge is needed
+    longest_runs = df_runs.loc[weekly['idxmax']].reset_index(drop=True)
+    longest_runs['year'] = longest_runs['iso_year']
+    longest_runs['week'] = longest_runs['iso_week']
+    longest_runs['weekly_total'] = weekly_totals['weekly_total'].to_numpy()
+
+    # Calculate percentage on the raw arrays, leaving NaN for weeks without distance
+    distance = longest_runs['distance'].to_numpy(dtype=float)
+    weekly_total = longest_runs['weekly_total'].to_numpy(dtype=float)
+    longest_runs['percentage'] = np.divide(
+        distance * 100, weekly_total, out=np.full_like(distance, np.nan), where=weekly_total > 0
+    )
+
+    # Sort by datetime first (while it's still in datetime format)
+    ordered_runs = longest_runs.sort_values('datetime_local', ascending=False, ignore_index=True)
+    distance_str, time_str, pace_str = format_activity_columns(
+        ordered_runs['distance'],
+        ordered_runs['moving_time'],
+        ordered_runs['average_speed']
+    )
+
+    # Assemble the display table in one constructor: text columns as Arrow strings for
+    # st.dataframe, numeric percentage kept for styling
+    longest_runs_display = pd.DataFrame({
+        'Data': pd.array(ordered_runs['datetime_local'].dt.strftime('%d/%m/%Y'), dtype='string[pyarrow]'),
+        'Nom': pd.array(ordered_runs['name'], dtype='string[pyarrow]'),
+        'Distància': pd.array(distance_str, dtype='string[pyarrow]'),
+        'Temps': pd.array(time_str, dtype='string[pyarrow]'),
+        'Ritme': pd.array(pace_str, dtype='string[pyarrow]'),
+        '% del total': ordered_runs['percentage']
+    })
+
+    return longest_runs, weekly_totals, longest_runs_display
+
+@st.cache_data(ttl=3600, max_entries=100, show_spinner=False)
+def get_filter_options(athlete_id, data_version, _df):
+    """
+    Get the earliest activity date and the activity types offered in the filter form.
+
+    Cached on the athlete and the data version of the loaded activities rather than on the
+    frame itself, so a rerun doesn't hash every activity just to look these up.
+    """
+    # Types in order of appearance (newest activity first), only those the athlete has used
+    return _df['datetime_local'].min().date(), _df['type'].unique().tolist()
+
+@st.cache_data(ttl=3600, max_entries=100, show_spinner=False)
+def build_weekly_volume(filter_key, _df_filtered):
+    """
+    Build the weekly volume and frequency tables for the volume and frequency sections.
+
+    Cached on the filter key instead of hashing the filtered frame, so reruns with the same
+    filters reuse the grouped frames.
+
+    Returns:
+    - weekly_distance: weekly distance (km) and time (h) with their percentage changes and date labels
+    - weekly_sessions: number of sessions per week with date labels
+    - weekly_runs: number of running sessions per week
+    """
+    # One groupby pass for the weekly distance, time, session and run counts
+    weekly = (
+        _df_filtered[['iso_year', 'iso_week', 'distance', 'moving_time', 'is_run']]
+        .groupby(['iso_year', 'iso_week'])
+        .agg(
+            Distance=('distance', 'sum'),
+            Time=('moving_time', 'sum'),
+            Sessions=('distance', 'size'),
+            Runs=('is_run', 'sum')
+        )
+        .reset_index()
+        .rename(columns={'iso_year': 'Year', 'iso_week': 'Week'})
+    )
+
+    # Add date column for x-axis labels, shared by the weekly tables
+    weekly['Week_Start_Date'] = week_start_dates(weekly['Year'], weekly['Week'])
+
+    weekly_distance = weekly.loc[:, ['Year', 'Week', 'Distance', 'Time', 'Week_Start_Date']]
+
+    # Calculate percentage changes
+    weekly_distance['Distance_pct'] = weekly_distance['Distance'].pct_change() * 100
+    weekly_distance['Time_pct'] = weekly_distance['Time'].pct_change() * 100
+
+    # Convert minutes to hours for better readability
+    weekly_distance['Time'] = weekly_distance['Time'] / 60
+    
+    # Format date with Catalan months
+    weekly_distance['Date_Label'] = format_catalan_dates(weekly_distance['Week_Start_Date'])
+
+    # Sessions per week
+    weekly_sessions = weekly.loc[:, ['Year', 'Week', 'Sessions', 'Week_Start_Date']]
+
+    weekly_sessions['Date_Label'] = format_catalan_dates(weekly_sessions['Week_Start_Date'], full_year=True)
+
+    # Run activities only, for the weeks that have any
+    weekly_runs = weekly.loc[weekly['Runs'] > 0, ['Year', 'Week', 'Runs']].reset_index(drop=True)
+
+    return weekly_distance, weekly_sessions, weekly_runs
+
+@st.cache_data(ttl=3600, max_entries=100, show_spinner=False)
+def build_intensity(filter_key, _df_filtered, race_pace, race_distance):
+    """
+    Classify the running and hiking sessions by intensity and count them per week.
+
+    Cached on the filter key and the reference pace and distance, so reruns that don't
+    change them reuse the classification and the weekly counts.
+
+    Returns:
+    - df_intensity: running and hiking sessions with their intensity index and zone
+    - adjusted_reference_pace_str: distance-adjusted reference pace ("4:30 min/km")
+    - intensity_by_week: number of sessions per week and intensity zone with date labels
+    """
+    # assign returns a new frame, so the pace columns are not written into the filtered activities.
+    # Pace is one column division (min/km); zero speeds become NaN like in speed_to_pace
+    df_intensity, adjusted_reference_pace_str = add_intensity_index(
+        _df_filtered[_df_filtered['sport'].isin(['Run', 'Hike'])].assign(
+            average_pace=lambda d: 60 / d['average_speed'].where(d['average_speed'] > 0)
+        ),
+        race_pace,
+        race_distance
+    )
+
+    # Group by week and intensity zone to get counts
+    intensity_by_week = df_intensity.groupby([
+        'iso_year',
+        'iso_week',
+        'intensity_zone_pace'
+    ]).size().reset_index()
+    intensity_by_week.columns = ['Year', 'Week', 'Intensity', 'Count']
+
+    # Add date column for x-axis labels
+    intensity_by_week['Week_Start_Date'] = week_start_dates(intensity_by_week['Year'], intensity_by_week['Week'])
+    
+    # Format date with Catalan months
+    intensity_by_week['Date_Label'] = format_catalan_dates(intensity_by_week['Week_Start_Date'], full_year=True)
+
+    return df_intensity, adjusted_reference_pace_str, intensity_by_week
+
+@st.cache_resource(show_spinner=False, max_entries=100)
+def build_distance_figure(weekly_distance):
+    """
+    Build the weekly distance bar chart with its percentage change labels.
+
+    Cached as a resource: st.plotly_chart serializes a Figure as-is, whereas a dict or JSON
+    input is validated into a new Figure on every call.
+    """
+    # Percentage change labels and their colors
+    distance_pct_text, distance_pct_colors = format_pct_changes(weekly_distance['Distance_pct'])
+
+    # Build the figure in one constructor: bars with formatted distance labels, percentage change
+    # labels on top and the layout with every axis setting, validated once
+    fig_distance = go.Figure(
+        data=[
+            go.Bar(
+                x=weekly_distance['Date_Label'],
+                y=weekly_distance['Distance'],
+                text=weekly_distance['Distance'].round(0).astype(int).astype(str) + 'km',  # Format as "10km"
+                textposition='inside',
+                marker_color='rgb(207, 240, 17)',
+                opacity=0.6,
+                textfont=dict(
+                    size=14
+                )
+            ),
+            go.Scatter(
+                x=weekly_distance['Date_Label'],
+                y=weekly_distance['Distance'],
+                text=distance_pct_text,
+                textposition='top center',
+                mode='text',
+                showlegend=False,
+                textfont=dict(
+                    size=14,
+                    color=distance_pct_colors
+                )
+            )
+        ],
+        layout=go.Layout(
+            title='Distància setmanal (km)',
+            showlegend=False,
+            plot_bgcolor='#fcfcfc',
+            paper_bgcolor='#fcfcfc',
+            xaxis=dict(
+                title='Setmana',
+                tickangle=45,  # Rotate labels for better readability
+                showgrid=False,
+                gridwidth=1,
+                gridcolor='#fcfcfc'
+            ),
+            yaxis=dict(
+                title='Distància (km)',
+                showgrid=False,
+                gridwidth=1,
+                gridcolor='#fcfcfc',
+                zeroline=True,
+                zerolinewidth=1,
+                zerolinecolor='#fcfcfc'
+            )
+        )
+    )
+
+    return fig_distance
+
+@st.cache_resource(show_spinner=False, max_entries=100)
+def build_time_figure(weekly_distance):
+    """
+    Build the weekly time bar chart with its percentage change labels.
+    """
+    # Format time labels as "3h50min"
+    total_minutes = (weekly_distance['Time'].to_numpy(dtype=float) * 60).astype(np.int64)
+    label_hours, label_minutes = np.divmod(total_minutes, 60)
+    time_labels = np.char.add(
+        np.char.add(label_hours.astype(str), 'h'),
+        np.char.add(np.char.zfill(label_minutes.astype(str), 2), 'min')
+    )
+
+    # Percentage change labels and their colors
+    time_pct_text, time_pct_colors = format_pct_changes(weekly_distance['Time_pct'])
+
+    # Build the figure in one constructor: bars with formatted time labels, percentage change
+    # labels on top and the layout with every axis setting
+    fig_time = go.Figure(
+        data=[
+            go.Bar(
+                x=weekly_distance['Date_Label'],
+                y=weekly_distance['Time'],
+                text=time_labels,
+                textposition='auto',
+                marker_color='rgb(207, 240, 17)',
+                opacity=0.6,
+                textfont=dict(
+                    size=14
+                )
+            ),
+            go.Scatter(
+                x=weekly_distance['Date_Label'],
+                y=weekly_distance['Time'],
+                text=time_pct_text,
+                textposition='top center',
+                mode='text',
+                showlegend=False,
+                textfont=dict(
+                    size=14,
+                    color=time_pct_colors
+                )
+            )
+        ],
+        layout=go.Layout(
+            title='Temps setmanal (hores)',
+            showlegend=False,
+            plot_bgcolor='#fcfcfc',
+            paper_bgcolor='#fcfcfc',
+            xaxis=dict(
+                title='Setmana',
+                tickangle=45,  # Rotate labels for better readability
+                showgrid=False,
+                gridwidth=1,
+                gridcolor='#fcfcfc'
+            ),
+            yaxis=dict(
+                title='Temps (h)',
+                showgrid=False,
+                gridwidth=1,
+                gridcolor='#fcfcfc',
+                zeroline=True,
+                zerolinewidth=1,
+                zerolinecolor='#fcfcfc'
+            )
+        )
+    )
+
+    return fig_time
+
+@st.cache_resource(show_spinner=False, max_entries=100)
+def build_longest_runs_figure(longest_runs, weekly_totals):
+    """
+    Build the chart of each week's longest run over the weekly running distance.
+    """
+    # Work on copies: the cached frames passed in are shared with the caller
+    longest_runs = longest_runs.copy()
+    weekly_totals = weekly_totals.copy()
+
+    # Format dates for x-axis
+    longest_runs['Week_Start_Date'] = week_start_dates(longest_runs['year'], longest_runs['week'])
+    weekly_totals['Week_Start_Date'] = week_start_dates(weekly_totals['year'], weekly_totals['week'])
+
+    # Format date labels with Catalan months
+    longest_runs['Date_Label'] = format_catalan_dates(longest_runs['Week_Start_Date'])
+    weekly_totals['Date_Label'] = format_catalan_dates(weekly_totals['Week_Start_Date'])
+
+    # Build the figure in one constructor: weekly distance bars with the longest run line on top
+    fig_longest = go.Figure(
+        data=[
+            go.Bar(
+                x=weekly_totals['Date_Label'],
+                y=weekly_totals['weekly_total'],
+                name='Distància setmanal',
+                marker_color='rgb(207, 240, 17)',
+                opacity=0.6,
+                hovertemplate='Setmana: %{x}<br>Distància total: %{y:.1f} km<extra></extra>'
+            ),
+            go.Scatter(
+                x=longest_runs['Date_Label'],
+                y=longest_runs['distance'],
+                mode='lines+markers+text',
+                name='Sortida més llarga',
+                marker_color='rgba(34, 40, 49, 0.6)',  # Converted from #222831 to rgba
+                text=longest_runs['distance'].round(1).astype(str) + 'km',
+                textposition='top center',
+                hovertemplate='Setmana: %{x}<br>Distància: %{y:.1f} km<extra></extra>'
+            )
+        ],
+        layout=go.Layout(
+            title='Long runs vs distància total setmanal',
+            showlegend=False,
+            plot_bgcolor='#fcfcfc',
+            paper_bgcolor='#fcfcfc',
+            legend=dict(
+                yanchor="top",
+                y=0.99,
+                xanchor="left",
+                x=0.01
+            ),
+            xaxis=dict(
+                title='Setmana',
+                tickangle=45,  # Rotate labels for better readability
+                showgrid=False,
+                gridwidth=1,
+                gridcolor='#fcfcfc'
+            ),
+            yaxis=dict(
+                title='Distància (km)',
+                range=[0, max(longest_runs['distance'].max(), weekly_totals['weekly_total'].max()) * 1.2],
+                showgrid=True,
+                gridwidth=1,
+                gridcolor='#fcfcfc',
+                zeroline=True,
+                zerolinewidth=1,
+                zerolinecolor='#fcfcfc'
+            )
+        )
+    )
+
+    return fig_longest
+
+@st.cache_resource(show_spinner=False, max_entries=100)
+def build_sessions_figure(weekly_sessions):
+    """
+    Build the sessions per week scatter chart.
+    """
+    fig_sessions = go.Figure(data=go.Scatter(
+        x=weekly_sessions['Date_Label'],
+        y=weekly_sessions['Sessions'],
+        mode='markers+text',
+        marker=dict(
+            size=weekly_sessions['Sessions'] * 5,
+            color=weekly_sessions['Sessions'],
+            colorscale='Reds',
+            showscale=False
+        ),
+        text=weekly_sessions['Sessions'],
+        textposition='top center'
+    ))
+
+    fig_sessions.update_layout(
+        title='Sessions per setmana',
+        xaxis_title='Setmana',
+        yaxis_title='',
+        plot_bgcolor='#fcfcfc',
+        paper_bgcolor='#fcfcfc',
+        yaxis=dict(
+            showgrid=False,
+            showticklabels=False,
+            showline=False
+        ),
+        xaxis=dict(
+            showgrid=False,
+            showline=False,
+            tickangle=45
+        )
+    )
+
+    return fig_sessions
+
+@st.cache_resource(show_spinner=False, max_entries=100)
+def build_intensity_figure(intensity_by_week):
+    """
+    Build the stacked bar chart of sessions per week and intensity zone.
+    """
+    # One bar trace per intensity zone, selecting its rows once
+    zone_traces = []
+    for intensity, color in INTENSITY_COLORS.items():
+        zone_weeks = intensity_by_week[intensity_by_week['Intensity'] == intensity]
+        zone_traces.append(
+            go.Bar(
+                name=intensity,
+                x=zone_weeks['Date_Label'].unique(),
+                y=zone_weeks['Count'],
+                text=zone_weeks['Count'],
+                textposition='auto',
+                marker_color=color,
+                textfont=dict(
+                    size=14,
+                    color='white'
+                )
+            )
+        )
+
+    # Create the stacked bar chart in one constructor
+    fig_intensity = go.Figure(
+        data=zone_traces,
+        layout=go.Layout(
+            title='Distribució de la intensitat: sessions per setmana',
+            barmode='stack',
+            plot_bgcolor='#fcfcfc',
+            paper_bgcolor='#fcfcfc',
+            showlegend=False,
+            legend=dict(
+                yanchor="top",
+                y=0.99,
+                xanchor="left",
+                x=0.01
+            ),
+            xaxis=dict(
+                title='Setmana',
+                tickangle=45,  # Rotate labels for better readability
+                showgrid=False,
+                gridwidth=1,
+                gridcolor='LightGray'
+            ),
+            yaxis=dict(
+                title='Nombre de sessions',
+                showgrid=False,
+                gridwidth=1,
+                gridcolor='LightGray',
+                zeroline=True,
+                zerolinewidth=1,
+                zerolinecolor='LightGray'
+            )
+        )
+    )
+
+    return fig_intensity
+
 def analyze_volume_progression(weekly_distance):
     """
     Analyze weekly volume progression to check if it follows good practices:
@@ -716,6 +1483,11 @@ def get_segments_data(activities, get_activity_details, get_segment_details, acc
     
     return df_segments
 
+@st.cache_resource
+def get_background_executor():
+    """Small thread pool, shared by all sessions, for Supabase writes the page doesn't need to wait on"""
+    return ThreadPoolExecutor(max_workers=2)
+
 # After the supabase client initialization, add this function:
 def log_user_session(athlete_id: Optional[int], event_type: str, event_data: Optional[dict] = None):
     """
@@ -726,17 +1498,22 @@ def log_user_session(athlete_id: Optional[int], event_type: str, event_data: Opt
     - event_type: Type of event (e.g., 'app_open', 'auth_start', 'data_load', etc.)
     - event_data: Optional dictionary with additional event data
     """
+    log_entry = {
+        'athlete_id': athlete_id if athlete_id is not None else 0,  # Use 0 for unauthenticated users
+        'event_type': event_type,
+        'event_data': event_data,
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    }
+    
+    # The insert runs in the background so the page doesn't wait on Supabase on every rerun
+    get_background_executor().submit(insert_log_entry, log_entry)
+
+def insert_log_entry(log_entry):
+    """Insert a log entry into Supabase. Runs on a worker thread, so errors go to the server log."""
     try:
-        log_entry = {
-            'athlete_id': athlete_id if athlete_id is not None else 0,  # Use 0 for unauthenticated users
-            'event_type': event_type,
-            'event_data': event_data,
-            'timestamp': datetime.now(timezone.utc).isoformat()
-        }
-        
-        supabase.table('app_logs').insert(log_entry).execute()
+        supabase.table('app_logs').insert(log_entry, returning='minimal').execute()
     except Exception as e:
-        st.error(f"Error logging event: {str(e)}")
+        logger.error(f"Error logging event: {str(e)}")
 
 # Initialize session state variables at the very beginning of the script, right after the imports
 if 'access_token' not in st.session_state:
@@ -761,7 +1538,6 @@ def main():
         try:
             token_data = get_token(code)
             if 'access_token' in token_data:
-                st.session_state.access_token = token_data['access_token']
                 st.session_state.athlete_id = token_data['athlete']['id']
                 save_token_to_supabase(token_data)
                 st.query_params.clear()
@@ -769,24 +1545,16 @@ def main():
         except Exception as e:
             st.error(f"Error during token exchange: {str(e)}")
     
-    # Try to get stored token if we don't have one in session
-    if not st.session_state.access_token and st.session_state.athlete_id is not None:
-        # Try to get a fresh token for this athlete
-        fresh_token = ensure_fresh_token()
-        if fresh_token:
-            st.session_state.access_token = fresh_token
-            st.rerun()
-        else:
-            st.warning("Si us plau, connecta amb Strava primer a la pàgina d'inici.")
-            st.markdown("[Connecta amb Strava](/Inici)")
-            st.stop()
-    elif not st.session_state.access_token:
+    # Get a valid token for this athlete, only going to Supabase when the session one is missing or expiring
+    fresh_token = ensure_fresh_token()
+    if not fresh_token:
         st.warning("Si us plau, connecta amb Strava primer a la pàgina d'inici.")
         st.markdown("[Connecta amb Strava](/Inici)")
         st.stop()
+    st.session_state.access_token = fresh_token
 
-    activities = get_activities(st.session_state.access_token)
-    if activities:
+    activities, data_version = sync_activities(st.session_state.athlete_id, st.session_state.access_token)
+    if not activities.empty:
         # Log successful data load
         log_user_session(
             st.session_state.athlete_id,
@@ -794,14 +1562,13 @@ def main():
             {
                 'activities_count': len(activities),
                 'date_range': [
-                    min(a['datetime_local'] for a in activities),
-                    max(a['datetime_local'] for a in activities)
+                    activities['datetime_local'].min().isoformat(),
+                    activities['datetime_local'].max().isoformat()
                 ]
             }
         )
         
-        # Convert activities to DataFrame
-        df = pd.DataFrame(activities)
+        df = activities
     else:
         # Log failed data load
         log_user_session(
@@ -811,12 +1578,12 @@ def main():
         st.warning("No s'han trobat activitats.")
 
     if df is not None:
+        # datetime_local is parsed once when the activities are loaded; only today's date is needed here
+        today = datetime.now().date()
+
         # Add these session state initializations
         if 'date_range' not in st.session_state:
-            st.session_state.date_range = (
-                pd.to_datetime('now').date() - pd.DateOffset(days=60),
-                pd.to_datetime('now').date()
-            )
+            st.session_state.date_range = (today - timedelta(days=60), today)
         if 'selected_activity_type' not in st.session_state:
             st.session_state.selected_activity_type = []
         if 'form_submitted' not in st.session_state:
@@ -838,17 +1605,17 @@ def main():
         with st.container(border=False):
             # Modify the form to update session state
             with st.form("date_selection_form", border=True):
+                min_activity_date, running_types = get_filter_options(st.session_state.athlete_id, data_version, df)
                 col1, col2, col3 = st.columns([1,2,1])
                 with col1:
                     selected_dates = st.date_input(
                         "",
                         value=st.session_state.date_range,
-                        min_value=pd.to_datetime(df['datetime_local'].min()).date(),
-                        max_value=pd.to_datetime('now').date(),
+                        min_value=min_activity_date,
+                        max_value=today,
                         label_visibility="collapsed"
                     )
                 with col2:
-                    running_types = df['type'].unique().tolist()
                     selected_type = st.multiselect(
                         "Selecciona el tipus de cursa:",
                         options=running_types,
@@ -870,21 +1637,50 @@ def main():
                 st.info("Selecciona el període de temps, els esports que vols incloure i fes clic a 'Guardar' per començar l'anàlisi.")
                 st.stop()
 
-            # Use session state values for filtering
-            df['datetime_local'] = pd.to_datetime(df['datetime_local'])
-            
-            if not st.session_state.selected_activity_type:  # If no types selected, show all
-                mask = (
-                    (df['datetime_local'].dt.date >= pd.to_datetime(st.session_state.date_range[0]).date()) & 
-                    (df['datetime_local'].dt.date <= pd.to_datetime(st.session_state.date_range[1]).date())
-                )
-            else:  # Filter for selected types
-                mask = (
-                    (df['datetime_local'].dt.date >= pd.to_datetime(st.session_state.date_range[0]).date()) & 
-                    (df['datetime_local'].dt.date <= pd.to_datetime(st.session_state.date_range[1]).date()) &
-                    (df['type'].isin(st.session_state.selected_activity_type))
+            # Use session state values for filtering, reusing the last result while the filters
+            # and the loaded activities are unchanged (e.g. reruns from the intensity widgets)
+            filter_key = (
+                st.session_state.athlete_id,
+                data_version,
+                tuple(str(d) for d in st.session_state.date_range),
+                tuple(st.session_state.selected_activity_type)
+            )
+            if st.session_state.get('filter_key') == filter_key:
+                df_filtered = st.session_state.df_filtered
+            else:
+                # Activities are sorted newest first, so the date range (end bound exclusive, next
+                # midnight) is a block of rows found by binary search on the ascending datetimes
+                ascending_datetimes = df['datetime_local'].to_numpy()[::-1]
+                start = pd.Timestamp(st.session_state.date_range[0]).to_datetime64()
+                end = (pd.Timestamp(st.session_state.date_range[1]) + pd.Timedelta(days=1)).to_datetime64()
+                first_row = len(df) - np.searchsorted(ascending_datetimes, end, side='left')
+                last_row = len(df) - np.searchsorted(ascending_datetimes, start, side='left')
+                df_filtered = df.iloc[first_row:last_row]
+
+                if st.session_state.selected_activity_type:  # If no types selected, show all
+                    # Compare integer category codes on the date-sliced rows only
+                    type_codes = df_filtered['type'].cat.categories.get_indexer(st.session_state.selected_activity_type)
+                    df_filtered = df_filtered.iloc[
+                        np.isin(df_filtered['type'].cat.codes.to_numpy(), type_codes[type_codes >= 0])
+                    ]
+
+                # ISO year/week computed once here for every weekly groupby downstream, as
+                # plain small integers instead of the nullable UInt32 isocalendar returns.
+                # The running mask is shared the same way by the volume and long runs sections
+                iso = df_filtered['datetime_local'].dt.isocalendar()
+                df_filtered = df_filtered.assign(
+                    iso_year=iso['year'].astype('int16'),
+                    iso_week=iso['week'].astype('int8'),
+                    is_run=(df_filtered['sport'] == 'Run').to_numpy()
                 )
-            df_filtered = df[mask]
+
+                st.session_state.filter_key = filter_key
+                st.session_state.df_filtered = df_filtered
+
+            # Nothing to analyse: skip every downstream aggregation and chart
+            if df_filtered.empty:
+                st.info("Cap activitat coincideix amb els filtres seleccionats.")
+                st.stop()
 
         st.markdown("## Volum")
         
@@ -903,202 +1699,23 @@ def main():
 
         col1v, col2v = st.columns([0.7,0.3])
         with col1v:
-            # Create tabs for distance and time charts
-            tab1, tab2 = st.tabs(["📏 Distància", "⏱️ Temps"])
-
-            # Group by year-week and sum distances
-            weekly_distance = df_filtered.groupby([
-                df_filtered['datetime_local'].dt.isocalendar().year,
-                df_filtered['datetime_local'].dt.isocalendar().week
-            ]).agg({
-                'distance': 'sum',
-                'moving_time': 'sum'
-            }).reset_index()
-            weekly_distance.columns = ['Year', 'Week', 'Distance', 'Time']
-
-            # Create a combined year-week label for x-axis
-            weekly_distance['Week_Label'] = weekly_distance.apply(lambda x: f"S{int(x['Week']):02d}", axis=1)
-            
-            # Calculate percentage changes
-            weekly_distance['Distance_pct'] = weekly_distance['Distance'].pct_change() * 100
-            weekly_distance['Time_pct'] = weekly_distance['Time'].pct_change() * 100
-
-            # Add date column for x-axis labels
-            # Create Catalan month mapping
-            catalan_months = {
-                'Jan': 'Gen',
-                'Feb': 'Feb',
-                'Mar': 'Mar',
-                'Apr': 'Abr',
-                'May': 'Mai',
-                'Jun': 'Jun',
-                'Jul': 'Jul',
-                'Aug': 'Ago',
-                'Sep': 'Set',
-                'Oct': 'Oct',
-                'Nov': 'Nov',
-                'Dec': 'Des'
-            }
-
-            weekly_distance['Week_Start_Date'] = pd.to_datetime(weekly_distance['Year'].astype(str) + '-' + 
-                                                              weekly_distance['Week'].astype(str) + '-1', 
-                                                              format='%Y-%W-%w')
-            
-            # Format date with Catalan months
-            weekly_distance['Date_Label'] = weekly_distance['Week_Start_Date'].dt.strftime('%d-%b-%y')
-            weekly_distance['Date_Label'] = weekly_distance['Date_Label'].apply(
-                lambda x: x.replace(x[3:6], catalan_months[x[3:6]])
+            # Switch between the distance and time charts with a radio instead of st.tabs, which
+            # builds and sends both charts on every rerun; only the selected one is rendered
+            volume_chart = st.radio(
+                "Gràfic de volum",
+                ["📏 Distància", "⏱️ Temps"],
+                horizontal=True,
+                label_visibility="collapsed",
+                key="volume_chart"
             )
 
-            with tab1:
-                # Create the distance bar chart
-                fig_distance = go.Figure()
-                mean_distance = weekly_distance['Distance'].mean()
-
-                # Add main bars with formatted distance labels
-                fig_distance.add_trace(
-                    go.Bar(
-                        x=weekly_distance['Date_Label'],
-                        y=weekly_distance['Distance'],
-                        text=weekly_distance['Distance'].round(0).astype(int).astype(str) + 'km',  # Format as "10km"
-                        textposition='inside',
-                        marker_color='rgb(207, 240, 17)',
-                        opacity=0.6,
-                        textfont=dict(
-                            size=14
-                        )
-                    )
-                )
-
-                # Add percentage change labels for distance chart
-                fig_distance.add_trace(
-                    go.Scatter(
-                        x=weekly_distance['Date_Label'],
-                        y=weekly_distance['Distance'],
-                        text=weekly_distance['Distance_pct'].apply(
-                            lambda x: f"{x:+.0f}%" if pd.notnull(x) else ""
-                        ),
-                        textposition='top center',
-                        mode='text',
-                        showlegend=False,
-                        textfont=dict(
-                            size=14,
-                            color=weekly_distance['Distance_pct'].apply(
-                                lambda x: '#DAA520' if pd.notnull(x) and (x > 10 or x < -10) else 'green'
-                            )
-                        )
-                    )
-                )
-
-                # Update layout with rotated x-axis labels for better readability
-                fig_distance.update_layout(
-                    title='Distància setmanal (km)',
-                    xaxis_title='Setmana',
-                    yaxis_title='Distància (km)',
-                    showlegend=False,
-                    plot_bgcolor='#fcfcfc',
-                    paper_bgcolor='#fcfcfc',
-                    xaxis=dict(
-                        tickangle=45  # Rotate labels for better readability
-                    )
-                )
-                
-                # Update axes
-                fig_distance.update_xaxes(
-                    showgrid=False,
-                    gridwidth=1,
-                    gridcolor='#fcfcfc'
-                )
-                fig_distance.update_yaxes(
-                    showgrid=False,
-                    gridwidth=1,
-                    gridcolor='#fcfcfc',
-                    zeroline=True,
-                    zerolinewidth=1,
-                    zerolinecolor='#fcfcfc'
-                )
-                
-                st.plotly_chart(fig_distance, use_container_width=True)
-
-            with tab2:
-                # Convert minutes to hours for better readability
-                weekly_distance['Time'] = weekly_distance['Time'] / 60  # Convert to hours
-                mean_time = weekly_distance['Time'].mean()
-
-                # Create the time bar chart
-                fig_time = go.Figure()
-                
-                # Format time labels as "3h50min"
-                def format_time_label(hours):
-                    total_minutes = int(hours * 60)
-                    h = total_minutes // 60
-                    m = total_minutes % 60
-                    return f"{h}h{m:02d}min"
-
-                # Add main bars with formatted time labels
-                fig_time.add_trace(
-                    go.Bar(
-                        x=weekly_distance['Date_Label'],
-                        y=weekly_distance['Time'],
-                        text=weekly_distance['Time'].apply(format_time_label),
-                        textposition='auto',
-                        marker_color='rgb(207, 240, 17)',
-                        opacity=0.6,
-                        textfont=dict(
-                            size=14
-                        )
-                    )
-                )
-
-                # Add percentage change labels
-                fig_time.add_trace(
-                    go.Scatter(
-                        x=weekly_distance['Date_Label'],
-                        y=weekly_distance['Time'],
-                        text=weekly_distance['Time_pct'].apply(
-                            lambda x: f"{x:+.0f}%" if pd.notnull(x) else ""
-                        ),
-                        textposition='top center',
-                        mode='text',
-                        showlegend=False,
-                        textfont=dict(
-                            size=14,
-                            color=weekly_distance['Time_pct'].apply(
-                                lambda x: '#DAA520' if pd.notnull(x) and (x > 10 or x < -10) else 'green'
-                            )
-                        )
-                    )
-                )
+            # Weekly distance, time and session counts (cached on the filtered activities)
+            weekly_distance, weekly_sessions, weekly_runs = build_weekly_volume(filter_key, df_filtered)
 
-                # Update layout with rotated x-axis labels for better readability
-                fig_time.update_layout(
-                    title='Temps setmanal (hores)',
-                    xaxis_title='Setmana',
-                    yaxis_title='Temps (h)',
-                    showlegend=False,
-                    plot_bgcolor='#fcfcfc',
-                    paper_bgcolor='#fcfcfc',
-                    xaxis=dict(
-                        tickangle=45  # Rotate labels for better readability
-                    )
-                )
-                
-                # Update axes
-                fig_time.update_xaxes(
-                    showgrid=False,
-                    gridwidth=1,
-                    gridcolor='#fcfcfc'
-                )
-                fig_time.update_yaxes(
-                    showgrid=False,
-                    gridwidth=1,
-                    gridcolor='#fcfcfc',
-                    zeroline=True,
-                    zerolinewidth=1,
-                    zerolinecolor='#fcfcfc'
-                )
-                
-                st.plotly_chart(fig_time, use_container_width=True)
+            if volume_chart == "📏 Distància":
+                st.plotly_chart(build_distance_figure(weekly_distance), use_container_width=True)
+            else:
+                st.plotly_chart(build_time_figure(weekly_distance), use_container_width=True)
         with col2v:
             st.markdown("""
             <div style="background-color: #ffffff; padding: 20px; border-radius: 0px; box-shadow: 0 0 10px rgba(0,0,0,0.1);">
@@ -1126,67 +1743,29 @@ def main():
             </div>
         </div>
         """, unsafe_allow_html=True)
-        # Get longest activity per week and weekly totals
-        weekly_totals = df_filtered[df_filtered['sport'] == 'Run'].groupby([
-            df_filtered['datetime_local'].dt.isocalendar().year,
-            df_filtered['datetime_local'].dt.isocalendar().week
-        ])['distance'].sum().reset_index()
-        weekly_totals.columns = ['year', 'week', 'weekly_total']
-        
-        longest_runs = df_filtered[df_filtered['sport'] == 'Run'].groupby([
-            df_filtered['datetime_local'].dt.isocalendar().year,
-            df_filtered['datetime_local'].dt.isocalendar().week
-        ]).apply(
-            lambda x: x.nlargest(1, 'distance')
-        ).reset_index(drop=True)
-
-        # Add weekly totals to longest runs
-        longest_runs['year'] = longest_runs['datetime_local'].dt.isocalendar().year
-        longest_runs['week'] = longest_runs['datetime_local'].dt.isocalendar().week
-        longest_runs = longest_runs.merge(weekly_totals, on=['year', 'week'], how='left')
-        
-        # Calculate percentage
-        longest_runs['percentage'] = (longest_runs['distance'] / longest_runs['weekly_total'] * 100)
-
-        # Select columns for display - keep numeric percentage for styling
-        longest_runs_display = longest_runs[[
-            'datetime_local', 'name', 'distance', 'moving_time', 'average_speed', 'percentage'
-        ]].copy()
-
-        # Create a mapping of activity names to workout types for styling
-        activity_workout_types = df_filtered.set_index('name')['workout_type'].to_dict()
-
-        # Sort by datetime first (while it's still in datetime format)
-        longest_runs_display = longest_runs_display.sort_values('datetime_local', ascending=False)
-
-        # Format display columns (except percentage)
-        longest_runs_display['datetime_local'] = longest_runs_display['datetime_local'].dt.strftime('%d/%m/%Y')
-        longest_runs_display['moving_time'] = longest_runs_display['moving_time'].apply(
-            lambda x: f"{int(x//60)}h{int(x%60)}min" if x >= 60 else f"{int(x)}min"
-        )
-        longest_runs_display['distance'] = longest_runs_display['distance'].apply(lambda x: f"{x:.1f} km")
-        longest_runs_display['average_speed'] = longest_runs_display['average_speed'].apply(
-            lambda x: f"{int((60/x))}:{int((60/x)%1 * 60):02d} min/km"
-        )
-        # The 'percentage' column is still numeric here
-
-        # Rename columns for final display
-        longest_runs_display.columns = ['Data', 'Nom', 'Distància', 'Temps', 'Ritme', '% del total']
-
-        # Define styling function for race activities
-        def style_race_activities(val):
-            if val in activity_workout_types and activity_workout_types[val] == 1:
-                return 'background-color: #FFB6C1'  # Light red color
-            return ''
-
-        # Define styling function for percentage background
-        def style_percentage_background(val):
-            if pd.isna(val):
-                return '' # No style for NaN
-            elif 30 <= val <= 40:
-                return 'background-color: lightgreen'
-            else:
-                return 'background-color: #FFFFE0' # Light Yellow hex
+        longest_runs, weekly_totals, longest_runs_display = build_longest_runs(filter_key, df_filtered)
+
+        # Names of the activities marked as races (workout_type 1); for repeated names the
+        # last activity decides, as in a name -> workout type mapping
+        named_activities = df_filtered.drop_duplicates('name', keep='last')
+        race_names = named_activities.loc[named_activities['workout_type'] == 1, 'name']
+
+        # Define styling function for race activities, evaluated on the whole name column
+        def style_race_activities(col):
+            return np.where(col.isin(race_names).to_numpy(), 'background-color: #FFB6C1', '')  # Light red color
+
+        # Define styling function for percentage background, evaluated on the whole numeric column
+        def style_percentage_background(col):
+            pct = col.to_numpy(dtype=float)
+            return np.where(
+                np.isnan(pct),
+                '',  # No style for NaN
+                np.where(
+                    (pct >= 30) & (pct <= 40),
+                    'background-color: lightgreen',
+                    'background-color: #FFFFE0'  # Light Yellow hex
+                )
+            )
 
         # Create two columns for the dataframe and description
         col1_long, col2_long = st.columns([0.7, 0.3])
@@ -1195,14 +1774,9 @@ def main():
             st.write("**Sessió més llarga per setmana i % del total de distància setmanal**")
             st.dataframe(
                 longest_runs_display.style
-                .apply(lambda col: col.map(style_race_activities) if col.name == 'Nom' else [''] * len(col))
-                .apply(
-                    lambda col: col.map(style_percentage_background),
-                    subset=['% del total']
-                )
-                .format(
-                    {'% del total': lambda x: f"{x:.1f}%" if pd.notna(x) else "-"}
-                ),
+                .apply(style_race_activities, subset=['Nom'])
+                .apply(style_percentage_background, subset=['% del total'])
+                .format('{:.1f}%', subset=['% del total'], na_rep='-'),
                 use_container_width=True,
                 hide_index=True
             )
@@ -1218,91 +1792,7 @@ def main():
             </div>
             """, unsafe_allow_html=True)
 
-        # Create line chart for longest runs with weekly distance bars
-        fig_longest = go.Figure()
-        
-        # Format dates for x-axis
-        longest_runs['Week_Start_Date'] = pd.to_datetime(longest_runs['year'].astype(str) + '-' + 
-                                                       longest_runs['week'].astype(str) + '-1', 
-                                                       format='%Y-%W-%w')
-        weekly_totals['Week_Start_Date'] = pd.to_datetime(weekly_totals['year'].astype(str) + '-' + 
-                                                        weekly_totals['week'].astype(str) + '-1', 
-                                                        format='%Y-%W-%w')
-
-        # Format date labels with Catalan months
-        longest_runs['Date_Label'] = longest_runs['Week_Start_Date'].dt.strftime('%d-%b-%y')
-        longest_runs['Date_Label'] = longest_runs['Date_Label'].apply(
-            lambda x: x.replace(x[3:6], catalan_months[x[3:6]])
-        )
-        weekly_totals['Date_Label'] = weekly_totals['Week_Start_Date'].dt.strftime('%d-%b-%y')
-        weekly_totals['Date_Label'] = weekly_totals['Date_Label'].apply(
-            lambda x: x.replace(x[3:6], catalan_months[x[3:6]])
-        )
-
-        # Add weekly distance bars
-        fig_longest.add_trace(
-            go.Bar(
-                x=weekly_totals['Date_Label'],
-                y=weekly_totals['weekly_total'],
-                name='Distància setmanal',
-                marker_color='rgb(207, 240, 17)',
-                opacity=0.6,
-                hovertemplate='Setmana: %{x}<br>Distància total: %{y:.1f} km<extra></extra>'
-            )
-        )
-        
-        # Add longest run line
-        fig_longest.add_trace(
-            go.Scatter(
-                x=longest_runs['Date_Label'],
-                y=longest_runs['distance'],
-                mode='lines+markers+text',
-                name='Sortida més llarga',
-                marker_color='rgba(34, 40, 49, 0.6)',  # Converted from #222831 to rgba
-                text=longest_runs['distance'].round(1).astype(str) + 'km',
-                textposition='top center',
-                hovertemplate='Setmana: %{x}<br>Distància: %{y:.1f} km<extra></extra>'
-            )
-        )
-
-        # Update layout
-        fig_longest.update_layout(
-            title='Long runs vs distància total setmanal',
-            xaxis_title='Setmana',
-            yaxis_title='Distància (km)',
-            showlegend=False,
-            plot_bgcolor='#fcfcfc',
-            paper_bgcolor='#fcfcfc',
-            yaxis=dict(
-                range=[0, max(longest_runs['distance'].max(), weekly_totals['weekly_total'].max()) * 1.2]
-            ),
-            legend=dict(
-                yanchor="top",
-                y=0.99,
-                xanchor="left",
-                x=0.01
-            ),
-            xaxis=dict(
-                tickangle=45  # Rotate labels for better readability
-            )
-        )
-
-        # Update axes
-        fig_longest.update_xaxes(
-            showgrid=False,
-            gridwidth=1,
-            gridcolor='#fcfcfc'
-        )
-        fig_longest.update_yaxes(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='#fcfcfc',
-            zeroline=True,
-            zerolinewidth=1,
-            zerolinecolor='#fcfcfc'
-        )
-
-        st.plotly_chart(fig_longest, use_container_width=True)
+        st.plotly_chart(build_longest_runs_figure(longest_runs, weekly_totals), use_container_width=True)
         
         st.divider()
         st.markdown("## Freqüència")
@@ -1320,26 +1810,10 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        # Count sessions per week
-        weekly_sessions = df_filtered.groupby([
-            df_filtered['datetime_local'].dt.isocalendar().year,
-            df_filtered['datetime_local'].dt.isocalendar().week
-        ]).size().reset_index()
-        weekly_sessions.columns = ['Year', 'Week', 'Sessions']
-
-        # Create a combined year-week label for x-axis
-        weekly_sessions['Week_Label'] = weekly_sessions.apply(lambda x: f"S{int(x['Week']):02d}", axis=1)
-
         # Calculate metrics for all activities
         mode_sessions = weekly_sessions['Sessions'].mode()[0]  # [0] because mode can return multiple values
-        avg_sessions = weekly_sessions['Sessions'].mean()
 
         # Calculate metrics for Run activities only
-        weekly_runs = df_filtered[df_filtered['sport'] == 'Run'].groupby([
-            df_filtered['datetime_local'].dt.isocalendar().year,
-            df_filtered['datetime_local'].dt.isocalendar().week
-        ]).size().reset_index()
-        weekly_runs.columns = ['Year', 'Week', 'Runs']
         avg_runs = weekly_runs['Runs'].mean()
 
         # Create three columns for the metrics
@@ -1361,54 +1835,12 @@ def main():
             """, unsafe_allow_html=True)
 
         # Create the sessions bar chart
-        # Add date column for x-axis labels
-        weekly_sessions['Week_Start_Date'] = pd.to_datetime(weekly_sessions['Year'].astype(str) + '-' + 
-                                                          weekly_sessions['Week'].astype(str) + '-1', 
-                                                          format='%Y-%W-%w')
-        
-        weekly_sessions['Date_Label'] = weekly_sessions['Week_Start_Date'].dt.strftime('%d-%b-%Y')
-        weekly_sessions['Date_Label'] = weekly_sessions['Date_Label'].apply(
-            lambda x: x.replace(x[3:6], catalan_months[x[3:6]])
-        )
-
         # Create two columns for the chart and description
         col1_chart, col2_desc = st.columns([0.7, 0.3])
 
         with col1_chart:
             st.write("")
-            fig_sessions = go.Figure(data=go.Scatter(
-                x=weekly_sessions['Date_Label'],
-                y=weekly_sessions['Sessions'],
-                mode='markers+text',
-                marker=dict(
-                    size=weekly_sessions['Sessions'] * 5,
-                    color=weekly_sessions['Sessions'],
-                    colorscale='Reds',
-                    showscale=False
-                ),
-                text=weekly_sessions['Sessions'],
-                textposition='top center'
-            ))
-
-            fig_sessions.update_layout(
-                title='Sessions per setmana',
-                xaxis_title='Setmana',
-                yaxis_title='',
-                plot_bgcolor='#fcfcfc',
-                paper_bgcolor='#fcfcfc',
-                yaxis=dict(
-                    showgrid=False,
-                    showticklabels=False,
-                    showline=False
-                ),
-                xaxis=dict(
-                    showgrid=False,
-                    showline=False,
-                    tickangle=45
-                )
-            )
-
-            st.plotly_chart(fig_sessions, use_container_width=True)
+            st.plotly_chart(build_sessions_figure(weekly_sessions), use_container_width=True)
 
         with col2_desc:
             st.write("")
@@ -1451,7 +1883,7 @@ def main():
             with col2img:
                 st.image(f"{current_dir}/assets/IMG_1237.jpg", width=300)
         # Get reference race speed (maximum speed from workout_type = 1)
-        race_activities = df_filtered[df_filtered['workout_type'] == 1].sort_values('average_speed', ascending=False).head(1)
+        race_activities = df_filtered[df_filtered['workout_type'] == 1].nlargest(1, 'average_speed')
         
         # Initialize detected race variables
         race_pace_detected = None
@@ -1459,27 +1891,30 @@ def main():
 
         # Format race activities for display if any exist
         if not race_activities.empty:
-            races_display = race_activities[[
-                'name', 'type', 'datetime_local', 'distance', 'moving_time', 'average_speed'
-            ]].copy()
-            
-            # Format the columns
-            races_display['datetime_local'] = races_display['datetime_local'].dt.strftime('%d/%m/%Y')
-            races_display['distance'] = races_display['distance'].apply(lambda x: f"{int(x)} km")
-            races_display['moving_time'] = races_display['moving_time'].apply(
-                lambda x: f"{int(x//60)}:{int(x%60):02d}"
-            )
-            races_display['average_speed'] = races_display['average_speed'].apply(
-                lambda x: f"{int((60/x))}:{int((60/x)%1 * 60):02d} min/km"
+            # Format time and pace (date and distance are formatted by st.column_config)
+            _, race_time_str, race_pace_str = format_activity_columns(
+                race_activities['distance'],
+                race_activities['moving_time'],
+                race_activities['average_speed'],
+                clock_time=True
             )
-            
-            # Rename columns
-            races_display.columns = ['Nom', 'Tipus', 'Data', 'Distància (km)', 'Temps (hh:min)', 'Ritme (min/km)']
+            races_display = pd.DataFrame({
+                'Nom': race_activities['name'].array,
+                'Tipus': race_activities['type'].array,
+                'Data': race_activities['datetime_local'].array,
+                'Distància (km)': race_activities['distance'].array,
+                'Temps (hh:min)': pd.array(race_time_str, dtype='string[pyarrow]'),
+                'Ritme (min/km)': pd.array(race_pace_str, dtype='string[pyarrow]')
+            })
             st.markdown("""
                         ##### Aquesta és la cursa amb ritme més alt detectada en el període:
                         """)
             st.dataframe(
                 races_display,
+                column_config={
+                    'Data': st.column_config.DateColumn(format='DD/MM/YYYY'),
+                    'Distància (km)': st.column_config.NumberColumn(format='%d km')
+                },
                 use_container_width=True,
                 hide_index=True
             )
@@ -1534,9 +1969,10 @@ def main():
             race_distance = race_distance_manual
             race_pace = race_pace_manual
 
-        # After creating df_filtered, add the pace column
-        df_filtered['average_pace'] = df_filtered['average_speed'].apply(speed_to_pace)
-        df_intensity, adjusted_reference_pace_str = add_intensity_index(df_filtered[df_filtered['sport'].isin(['Run', 'Hike'])], race_pace, race_distance)
+        # Intensity of the running and hiking sessions (cached on the filters and reference pace)
+        df_intensity, adjusted_reference_pace_str, intensity_by_week = build_intensity(
+            filter_key, df_filtered, race_pace, race_distance
+        )
 
         #st.dataframe(df_intensity[['datetime_local', 'average_pace', 'intensity_index', 'intensity_zone_pace', 'average_heartrate']])
         easy_percentage = compute_easy_percentage(df_intensity)
@@ -1570,90 +2006,9 @@ def main():
                 </div>
             """, unsafe_allow_html=True)
         st.write("")
-        # Group by week and intensity zone to get counts
-        intensity_by_week = df_intensity.groupby([
-            df_intensity['datetime_local'].dt.isocalendar().year,
-            df_intensity['datetime_local'].dt.isocalendar().week,
-            'intensity_zone_pace'
-        ]).size().reset_index()
-        intensity_by_week.columns = ['Year', 'Week', 'Intensity', 'Count']
-
-        # Add date column for x-axis labels
-        intensity_by_week['Week_Start_Date'] = pd.to_datetime(intensity_by_week['Year'].astype(str) + '-' + 
-                                                            intensity_by_week['Week'].astype(str) + '-1', 
-                                                            format='%Y-%W-%w')
-        
-        # Format date with Catalan months
-        intensity_by_week['Date_Label'] = intensity_by_week['Week_Start_Date'].dt.strftime('%d-%b-%Y')
-        intensity_by_week['Date_Label'] = intensity_by_week['Date_Label'].apply(
-            lambda x: x.replace(x[3:6], catalan_months[x[3:6]])
-        )
         col1_int_chart, col2_int_desc = st.columns([0.7, 0.3])
         with col1_int_chart:
-            # Create stacked bar chart
-            fig_intensity = go.Figure()
-
-            # Define colors for each intensity zone
-            intensity_colors = {
-                'Baixa': '#2ecc71',    # Green
-                'Moderada': '#f1c40f', # Yellow
-                'Alta': '#e74c3c'      # Red
-            }
-
-            # Add bars for each intensity zone
-            for intensity in ['Baixa', 'Moderada', 'Alta']:
-                mask = intensity_by_week['Intensity'] == intensity
-                fig_intensity.add_trace(
-                    go.Bar(
-                        name=intensity,
-                        x=intensity_by_week[mask]['Date_Label'].unique(),
-                        y=intensity_by_week[mask]['Count'],
-                        text=intensity_by_week[mask]['Count'],
-                        textposition='auto',
-                        marker_color=intensity_colors[intensity],
-                        textfont=dict(
-                            size=14,
-                            color='white'
-                        )
-                    )
-                )
-
-            # Update layout
-            fig_intensity.update_layout(
-                title='Distribució de la intensitat: sessions per setmana',
-                xaxis_title='Setmana',
-                yaxis_title='Nombre de sessions',
-                barmode='stack',
-                plot_bgcolor='#fcfcfc',
-                paper_bgcolor='#fcfcfc',
-                showlegend=False,
-                legend=dict(
-                    yanchor="top",
-                    y=0.99,
-                    xanchor="left",
-                    x=0.01
-                ),
-                xaxis=dict(
-                    tickangle=45  # Rotate labels for better readability
-                )
-            )
-
-            # Update axes
-            fig_intensity.update_xaxes(
-                showgrid=False,
-                gridwidth=1,
-                gridcolor='LightGray'        
-            )
-            fig_intensity.update_yaxes(
-                showgrid=False,
-                gridwidth=1,
-                gridcolor='LightGray',
-                zeroline=True,
-                zerolinewidth=1,
-                zerolinecolor='LightGray'
-            )
-
-            st.plotly_chart(fig_intensity, use_container_width=True)
+            st.plotly_chart(build_intensity_figure(intensity_by_week), use_container_width=True)
             
         with col2_int_desc:
             st.markdown("""
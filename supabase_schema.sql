@@ -4,10 +4,14 @@ create table strava_tokens (
     access_token text not null,
     refresh_token text not null,
     expires_at timestamp with time zone not null,
+    expires_at_unix bigint,
     created_at timestamp with time zone default now(),
     updated_at timestamp with time zone default now()
 );
 
+-- Existing databases: add the Unix expiry read by the token freshness check
+alter table strava_tokens add column if not exists expires_at_unix bigint;
+
 -- Enable Row Level Security (RLS)
 alter table strava_tokens enable row level security;
 